@@ -1,19 +1,48 @@
 import asyncio
+import glob
+import gzip
+import math
 import os
 import random
 import re
+import shutil
 import sqlite3
+import tempfile
+import time
+import zlib
+from collections import Counter, defaultdict, deque
 from datetime import datetime, timedelta, timezone
 
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
 from discord.utils import get
-import aiohttp
+
+from loopmon import LoopMonitor
+from traffic import TrafficRecorder
+from upstream import UpstreamClient, UpstreamError, MOJANG_URL, HYPIXEL_URL
 
 TOKEN = os.environ["DISCORD_BOT_TOKEN"]
 HYPIXEL_KEY = os.environ["HYPIXEL_API_KEY"]
 GUILD_ID = 1384308198944669877
+GUILD_NAME = "Sky Sanctuary"
+
+# one pooled client for every Mojang/Hypixel call; the URLs can be
+# overridden to point at a local fake server
+upstream = UpstreamClient(
+    HYPIXEL_KEY,
+    mojang_url=os.environ.get("MOJANG_API_URL", MOJANG_URL),
+    hypixel_url=os.environ.get("HYPIXEL_API_URL", HYPIXEL_URL),
+)
+
+# logs the blocking stack whenever the event loop stalls for > 250ms
+loop_monitor = LoopMonitor(interval=0.1, threshold=0.25, app_files=("bot.py",))
+PROFILE_DIR = "profiles"
+
+# set RECORD_TRAFFIC=traffic.jsonl.gz to capture anonymized gateway traffic
+# for replay.py
+RECORD_PATH = os.environ.get("RECORD_TRAFFIC")
+recorder = TrafficRecorder(RECORD_PATH, keep_ids=[GUILD_ID], guild_id=GUILD_ID) if RECORD_PATH else None
 
 intents = discord.Intents.default()
 intents.guilds = True
@@ -22,7 +51,20 @@ intents.messages = True
 intents.message_content = True
 intents.reactions = True
 
-bot = commands.Bot(command_prefix="!", intents=intents)
+class SanctuaryBot(commands.Bot):
+    async def setup_hook(self):
+        await upstream.start()
+        loop_monitor.start()
+        register_panel_views(self)
+
+    async def close(self):
+        loop_monitor.stop()
+        await upstream.close()
+        if recorder:
+            recorder.close()
+        await super().close()
+
+bot = SanctuaryBot(command_prefix="!", intents=intents, enable_debug_events=recorder is not None)
 tree = bot.tree
 
 XP_ROLES = [
@@ -44,25 +86,104 @@ BONUS_ROLES = {
     "Master Sergeant":     ("Senior Non-Commission Officer", "Non-Commission Officer"),
 }
 
-DB_PATH = "xp.db"
+DB_PATH = os.environ.get("XP_DB_PATH", "xp.db")
 conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+# WAL lets the backup/maintenance connections read while handlers write
+conn.execute("PRAGMA journal_mode=WAL")
 cursor = conn.cursor()
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS xp (
-    user_id   TEXT PRIMARY KEY,
-    xp        INTEGER NOT NULL,
-    last_ts   REAL    NOT NULL,
-    stars     INTEGER NOT NULL DEFAULT 0,
-    ratings   INTEGER NOT NULL DEFAULT 0
-)
-""")
-for col in ("stars", "ratings"):
-    try:
-        cursor.execute(f"ALTER TABLE xp ADD COLUMN {col} INTEGER NOT NULL DEFAULT 0")
-    except sqlite3.OperationalError:
-        # column already exists
-        pass
-conn.commit()
+
+def init_schema():
+    """Create or migrate every table. Safe to re-run, e.g. after a restore."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS xp (
+        user_id   TEXT PRIMARY KEY,
+        xp        INTEGER NOT NULL,
+        last_ts   REAL    NOT NULL,
+        stars     INTEGER NOT NULL DEFAULT 0,
+        ratings   INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    for col in ("stars", "ratings"):
+        try:
+            cursor.execute(f"ALTER TABLE xp ADD COLUMN {col} INTEGER NOT NULL DEFAULT 0")
+        except sqlite3.OperationalError:
+            # column already exists
+            pass
+    ledger_is_new = cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'xp_events'"
+    ).fetchone() is None
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS xp_events (
+        id        INTEGER PRIMARY KEY,
+        user_id   TEXT    NOT NULL,
+        amount    INTEGER NOT NULL,
+        source    TEXT    NOT NULL,
+        ts        REAL    NOT NULL
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS xp_events_user ON xp_events (user_id)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS xp_rollups (
+        period    TEXT    NOT NULL,
+        bucket    TEXT    NOT NULL,
+        user_id   TEXT    NOT NULL,
+        xp        INTEGER NOT NULL,
+        PRIMARY KEY (period, bucket, user_id)
+    )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS xp_rollups_rank ON xp_rollups (period, bucket, xp)")
+    if ledger_is_new:
+        # totals earned before the ledger existed, so totals can be rebuilt from it
+        cursor.execute("""
+            INSERT INTO xp_events (user_id, amount, source, ts)
+            SELECT user_id, xp, 'baseline', last_ts FROM xp WHERE xp != 0
+        """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS gexp_daily (
+        uuid      TEXT    NOT NULL,
+        day       INTEGER NOT NULL,
+        gexp      INTEGER NOT NULL,
+        PRIMARY KEY (uuid, day)
+    ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS gexp_guild_daily (
+        day       INTEGER PRIMARY KEY,
+        total     INTEGER NOT NULL,
+        members   INTEGER NOT NULL,
+        active    INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS dispatch_tickets (
+        channel_id   TEXT PRIMARY KEY,
+        carry_type   TEXT NOT NULL,
+        opener_id    TEXT NOT NULL,
+        offered_to   TEXT,
+        claimed_by   TEXT,
+        created_ts   REAL NOT NULL,
+        deadline_ts  REAL NOT NULL,
+        responded_ts REAL,
+        escalated    INTEGER NOT NULL DEFAULT 0
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS carrier_activity (
+        user_id   TEXT PRIMARY KEY,
+        last_seen REAL NOT NULL
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS ticket_pool (
+        channel_id  TEXT PRIMARY KEY,
+        category_id TEXT NOT NULL,
+        roles       TEXT NOT NULL,
+        created_ts  REAL NOT NULL
+    )
+    """)
+    conn.commit()
+
+init_schema()
 
 
 TICKET_REGEX = re.compile(
@@ -136,14 +257,153 @@ def get_user(user_id: str):
         return 0, now
     return row[0], row[1]
 
-def update_user(user_id: str, new_xp: int, new_last: float):
+def update_user(user_id: str, new_xp: int, new_last: float, amount: int = 0, source: str = None):
+    """Save a user's total; `amount`/`source` record the award in the ledger
+    in the same commit."""
     cursor.execute("""
         UPDATE xp
         SET xp = ?, last_ts = ?
         WHERE user_id = ?
     """, (new_xp, new_last, user_id))
+    log_xp(user_id, amount, source)
     conn.commit()
 
+# --- XP Ledger ---
+# Every award is appended to xp_events with its source ("chat", "finish",
+# "hypixel") and folded into per-user day/week/month rollups, in the same
+# transaction as the running total, so period leaderboards never scan events
+# and the ledger is never behind the total it can rebuild.
+def xp_buckets(ts: float) -> list[tuple[str, str]]:
+    dt = datetime.fromtimestamp(ts, timezone.utc)
+    year, week, _ = dt.isocalendar()
+    return [
+        ("day", dt.strftime("%Y-%m-%d")),
+        ("week", f"{year}-W{week:02d}"),
+        ("month", dt.strftime("%Y-%m")),
+    ]
+
+def log_xp(user_id: str, amount: int, source: str):
+    """Write a ledger entry and its rollups. The caller commits."""
+    if amount == 0:
+        return
+    ts = datetime.now(timezone.utc).timestamp()
+    cursor.execute(
+        "INSERT INTO xp_events (user_id, amount, source, ts) VALUES (?, ?, ?, ?)",
+        (user_id, amount, source, ts)
+    )
+    cursor.executemany("""
+        INSERT INTO xp_rollups (period, bucket, user_id, xp) VALUES (?, ?, ?, ?)
+        ON CONFLICT (period, bucket, user_id) DO UPDATE SET xp = xp + excluded.xp
+    """, [(period, bucket, user_id, amount) for period, bucket in xp_buckets(ts)])
+
+def period_xp(user_id: str, period: str) -> int:
+    bucket = dict(xp_buckets(datetime.now(timezone.utc).timestamp()))[period]
+    cursor.execute(
+        "SELECT xp FROM xp_rollups WHERE period = ? AND bucket = ? AND user_id = ?",
+        (period, bucket, user_id)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def period_leaderboard(period: str, limit: int = 10) -> list[tuple[str, int]]:
+    bucket = dict(xp_buckets(datetime.now(timezone.utc).timestamp()))[period]
+    cursor.execute(
+        "SELECT user_id, xp FROM xp_rollups WHERE period = ? AND bucket = ? ORDER BY xp DESC LIMIT ?",
+        (period, bucket, limit)
+    )
+    return cursor.fetchall()
+
+def rebuild_xp_totals() -> int:
+    """Reset every running total to the ledger sum. Returns how many had drifted."""
+    cursor.execute("""
+        SELECT xp.user_id, COALESCE(SUM(e.amount), 0) AS total
+        FROM xp LEFT JOIN xp_events e ON e.user_id = xp.user_id
+        GROUP BY xp.user_id
+        HAVING total != xp.xp
+    """)
+    drifted = cursor.fetchall()
+    cursor.executemany("UPDATE xp SET xp = ? WHERE user_id = ?", [(t, uid) for uid, t in drifted])
+    conn.commit()
+    return len(drifted)
+
+# --- Guild GEXP History ---
+# Each guild fetch carries 7 days of expHistory per member. Those values are
+# upserted into gexp_daily (day as YYYYMMDD), and the touched days are
+# re-aggregated into gexp_guild_daily so /guildstats never calls Hypixel.
+def gexp_day(d) -> int:
+    return int(d.strftime("%Y%m%d"))
+
+def store_exp_history(members: list[dict]):
+    rows = []
+    for m in members:
+        for date, gexp in m.get("expHistory", {}).items():
+            rows.append((m["uuid"], int(date.replace("-", "")), int(gexp)))
+    if not rows:
+        return
+    cursor.executemany("""
+        INSERT INTO gexp_daily (uuid, day, gexp) VALUES (?, ?, ?)
+        ON CONFLICT (uuid, day) DO UPDATE SET gexp = excluded.gexp
+    """, rows)
+    days = sorted({day for _, day, _ in rows})
+    cursor.execute(f"""
+        INSERT INTO gexp_guild_daily (day, total, members, active)
+        SELECT day, SUM(gexp), COUNT(*), SUM(gexp > 0) FROM gexp_daily
+        WHERE day IN ({",".join("?" * len(days))}) GROUP BY day
+        ON CONFLICT (day) DO UPDATE SET
+            total = excluded.total, members = excluded.members, active = excluded.active
+    """, days)
+    conn.commit()
+
+async def fetch_guild() -> dict:
+    """Fetch the Hypixel guild and keep its expHistory. Used by the sync
+    paths (daily check, /updatexp), not per-user lookups."""
+    data = await upstream.get_guild(GUILD_NAME)
+    store_exp_history(data.get("members", []))
+    return data
+
+def gexp_window(days: int, offset: int = 0) -> tuple[int, int]:
+    end = datetime.now(timezone.utc).date() - timedelta(days=offset)
+    return gexp_day(end - timedelta(days=days - 1)), gexp_day(end)
+
+def guild_gexp_stats(days: int) -> dict:
+    start, end = gexp_window(days)
+    cursor.execute(
+        "SELECT day, total, active FROM gexp_guild_daily WHERE day BETWEEN ? AND ? ORDER BY day",
+        (start, end)
+    )
+    rows = cursor.fetchall()
+    prev_start, prev_end = gexp_window(days, offset=days)
+    cursor.execute(
+        "SELECT COALESCE(SUM(total), 0) FROM gexp_guild_daily WHERE day BETWEEN ? AND ?",
+        (prev_start, prev_end)
+    )
+    return {
+        "total": sum(r[1] for r in rows),
+        "previous": cursor.fetchone()[0],
+        "days": len(rows),
+        "avg_active": sum(r[2] for r in rows) / len(rows) if rows else 0,
+        "best": max(rows, key=lambda r: r[1]) if rows else None,
+    }
+
+def member_gexp_stats(uuid: str, days: int) -> dict:
+    start, end = gexp_window(days)
+    prev_start, prev_end = gexp_window(days, offset=days)
+    cursor.execute("""
+        SELECT
+            COALESCE(SUM(CASE WHEN day BETWEEN ? AND ? THEN gexp END), 0),
+            COALESCE(SUM(CASE WHEN day BETWEEN ? AND ? THEN gexp END), 0),
+            COUNT(CASE WHEN day BETWEEN ? AND ? AND gexp > 0 THEN 1 END)
+        FROM gexp_daily WHERE uuid = ? AND day BETWEEN ? AND ?
+    """, (start, end, prev_start, prev_end, start, end, uuid, prev_start, end))
+    total, previous, active_days = cursor.fetchone()
+    return {"total": total, "previous": previous, "active_days": active_days}
+
+def trend(now: int, before: int) -> str:
+    if not before:
+        return "no earlier data"
+    change = (now - before) / before * 100
+    return f"{'▲' if change >= 0 else '▼'} {abs(change):.0f}% vs previous period"
+
 # --- Helper Functions ---
 async def get_or_create_role(guild: discord.Guild, role_name: str) -> discord.Role:
     role = get(guild.roles, name=role_name)
@@ -159,21 +419,390 @@ async def create_ticket_channel(
     welcome_msg: str
 ) -> discord.TextChannel:
     guild = category.guild
-    channel = await category.create_text_channel(channel_name)
-    await channel.set_permissions(guild.default_role, read_messages=False)
-    await channel.set_permissions(user, read_messages=True, send_messages=True)
+    channel = await take_pooled_channel(category, mention_roles)
+    if channel:
+        # already hidden and open to the carrier roles
+        try:
+            await channel.edit(name=channel_name, topic=None)
+            await channel.set_permissions(user, read_messages=True, send_messages=True)
+        except discord.HTTPException:
+            # its pool row is gone; don't leave it behind half-converted
+            try:
+                await channel.delete()
+            except discord.HTTPException:
+                pass
+            channel = None
+    if channel is None:
+        channel = await category.create_text_channel(channel_name)
+        await channel.set_permissions(guild.default_role, read_messages=False)
+        await channel.set_permissions(user, read_messages=True, send_messages=True)
 
     mentions = []
+    roles = []
     for role_name in mention_roles:
         role = await get_or_create_role(guild, role_name)
-        await channel.set_permissions(role, read_messages=True, send_messages=True)
+        if not channel.overwrites_for(role).read_messages:
+            await channel.set_permissions(role, read_messages=True, send_messages=True)
         mentions.append(role.mention)
-
-    mention_str = " ".join(mentions)
-    await channel.send(f"{mention_str} {user.mention} opened a ticket: **{welcome_msg}**")
+        roles.append(role)
+
+    # carry tickets go to one carrier first instead of pinging the whole role
+    carrier = None
+    if DISPATCH_OFFER_SECONDS > 0 and len(roles) == 1 and roles[0].name in CARRIER_ROLES:
+        carrier = dispatcher.pick(roles[0], exclude={user.id})
+    if carrier:
+        dispatcher.open_ticket(channel.id, roles[0].name, user.id, carrier.id)
+        await channel.send(
+            f"{carrier.mention} {user.mention} opened a ticket: **{welcome_msg}**\n"
+            f"{carrier.mention}, you're up first — reply here within {DISPATCH_OFFER_SECONDS // 60} minute(s) "
+            f"or it goes to every {roles[0].name}."
+        )
+    else:
+        mention_str = " ".join(mentions)
+        await channel.send(f"{mention_str} {user.mention} opened a ticket: **{welcome_msg}**")
     await channel.send(f"Hello {user.mention}! If you no longer need the carry, use `/close`\nPlease do not close the ticket if a carrier has responded to this ticket.\nYou can check a user's rating with `/rating`")
     return channel
 
+# --- Ticket Pool ---
+# Hidden, pre-permissioned channels kept per (category, carrier roles) so that
+# opening a ticket is a rename plus one overwrite. Idle channels are named
+# "pool-…" so TICKET_REGEX never matches them and carry POOL_TOPIC so we only
+# ever clean up channels we made; the ticket_pool table is the source of truth
+# and is reconciled against the guild on startup.
+TICKET_POOL_MAX = int(os.environ.get("TICKET_POOL_MAX", "0"))  # 0 disables the pool
+TICKET_POOL_MIN = int(os.environ.get("TICKET_POOL_MIN", "1"))
+TICKET_POOL_LEAD_HOURS = 0.25  # keep ~15 minutes of observed demand warm
+POOL_PREFIX = "pool-"
+POOL_TOPIC = "Reserved ticket channel (managed by the bot)"
+# panel channel → the carrier role its tickets ping; tickets open in the
+# panel's category, so these are the pools worth keeping warm from the start
+POOL_PANELS = {"dungeons": "Dungeon Carrier", "slayers": "Slayer Carrier", "kuudra": "Kuudra Carrier"}
+
+pool_demand: dict = defaultdict(deque)   # key → monotonic open times
+pool_locks: dict = defaultdict(asyncio.Lock)
+pool_refills: set = set()                # strong refs so refills aren't collected mid-run
+
+def pool_key(category: discord.CategoryChannel, role_names: list[str]) -> tuple:
+    return (str(category.id), ",".join(sorted(role_names)))
+
+def pool_target(key: tuple, idle: int) -> int:
+    """How many idle channels to keep for a key, from the last day of opens."""
+    now = time.monotonic()
+    opens = pool_demand[key]
+    while opens and now - opens[0] > 86400:
+        opens.popleft()
+    if not opens:
+        # no demand seen since restart → keep what is already there, but at
+        # least the floor so the first ticket after a deploy is fast too
+        return min(TICKET_POOL_MAX, max(TICKET_POOL_MIN, idle))
+    last_hour = sum(1 for t in opens if now - t <= 3600)
+    wanted = math.ceil(last_hour * TICKET_POOL_LEAD_HOURS)
+    return max(TICKET_POOL_MIN, min(TICKET_POOL_MAX, wanted))
+
+async def take_pooled_channel(category: discord.CategoryChannel, role_names: list[str]):
+    """Pop an idle pooled channel for this category/roles, or None."""
+    if TICKET_POOL_MAX <= 0:
+        return None
+    key = pool_key(category, role_names)
+    pool_demand[key].append(time.monotonic())
+    channel = None
+    # no awaits between select and delete, so this never races a refill
+    cursor.execute(
+        "SELECT channel_id FROM ticket_pool WHERE category_id = ? AND roles = ? ORDER BY created_ts",
+        key
+    )
+    for (channel_id,) in cursor.fetchall():
+        cursor.execute("DELETE FROM ticket_pool WHERE channel_id = ?", (channel_id,))
+        conn.commit()
+        found = category.guild.get_channel(int(channel_id))
+        if found and found.name.startswith(POOL_PREFIX):
+            channel = found
+            break
+    task = asyncio.create_task(fill_ticket_pool(category, role_names))
+    pool_refills.add(task)
+    task.add_done_callback(pool_refills.discard)
+    return channel
+
+async def fill_ticket_pool(category: discord.CategoryChannel, role_names: list[str]):
+    key = pool_key(category, role_names)
+    async with pool_locks[key]:
+        cursor.execute(
+            "SELECT channel_id FROM ticket_pool WHERE category_id = ? AND roles = ? ORDER BY created_ts",
+            key
+        )
+        idle = [r[0] for r in cursor.fetchall()]
+        target = pool_target(key, len(idle))
+
+        guild = category.guild
+        for channel_id in idle[target:]:
+            cursor.execute("DELETE FROM ticket_pool WHERE channel_id = ?", (channel_id,))
+            conn.commit()
+            if cursor.rowcount == 0:
+                # taken for a ticket while we were trimming
+                continue
+            extra = guild.get_channel(int(channel_id))
+            if extra:
+                try:
+                    await extra.delete()
+                except discord.HTTPException:
+                    pass
+
+        if len(idle) >= target:
+            return
+        overwrites = {guild.default_role: discord.PermissionOverwrite(read_messages=False)}
+        for role_name in role_names:
+            role = await get_or_create_role(guild, role_name)
+            overwrites[role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+        slug = role_names[0].lower().replace(" ", "-") if role_names else "ticket"
+        for _ in range(target - len(idle)):
+            try:
+                channel = await category.create_text_channel(
+                    f"{POOL_PREFIX}{slug}", topic=POOL_TOPIC, overwrites=overwrites
+                )
+            except discord.HTTPException:
+                break
+            cursor.execute(
+                "INSERT INTO ticket_pool (channel_id, category_id, roles, created_ts) VALUES (?, ?, ?, ?)",
+                (str(channel.id), key[0], key[1], datetime.now(timezone.utc).timestamp())
+            )
+            conn.commit()
+
+async def reconcile_ticket_pool(guild: discord.Guild):
+    """Drop rows whose channel is gone or in use, and delete orphaned pool channels."""
+    cursor.execute("SELECT channel_id FROM ticket_pool")
+    tracked = set()
+    for (channel_id,) in cursor.fetchall():
+        channel = guild.get_channel(int(channel_id))
+        if channel and channel.name.startswith(POOL_PREFIX):
+            tracked.add(channel.id)
+        else:
+            cursor.execute("DELETE FROM ticket_pool WHERE channel_id = ?", (channel_id,))
+    conn.commit()
+
+    # created right before a restart but never recorded; the topic marks it as
+    # ours, so staff channels that happen to start with "pool-" are left alone
+    for channel in guild.text_channels:
+        if channel.name.startswith(POOL_PREFIX) and channel.topic == POOL_TOPIC \
+                and channel.id not in tracked:
+            try:
+                await channel.delete()
+            except discord.HTTPException:
+                pass
+
+@tasks.loop(minutes=1)
+async def ticket_pool_loop():
+    guild = bot.get_guild(GUILD_ID)
+    if guild is None:
+        return
+    cursor.execute("SELECT DISTINCT category_id, roles FROM ticket_pool")
+    keys = set(cursor.fetchall()) | set(pool_demand)
+    for panel, role_name in POOL_PANELS.items():
+        channel = get(guild.text_channels, name=panel)
+        if channel and channel.category:
+            keys.add(pool_key(channel.category, [role_name]))
+    for category_id, roles in keys:
+        category = guild.get_channel(int(category_id))
+        if isinstance(category, discord.CategoryChannel):
+            await fill_ticket_pool(category, roles.split(","))
+
+@ticket_pool_loop.before_loop
+async def before_ticket_pool():
+    await bot.wait_until_ready()
+    guild = bot.get_guild(GUILD_ID)
+    if guild:
+        await reconcile_ticket_pool(guild)
+
+@bot.listen("on_guild_channel_delete")
+async def on_pooled_channel_delete(channel: discord.abc.GuildChannel):
+    cursor.execute("DELETE FROM ticket_pool WHERE channel_id = ?", (str(channel.id),))
+    conn.commit()
+
+# --- Carrier Dispatch ---
+# Carriers are ranked by open load, how recently they were active and their
+# rating; a new ticket is offered to the best one and escalated to the whole
+# role if nobody answers in time. Scores depend on the current time, so they
+# are computed when a ticket opens (rosters are a few dozen people). Tickets
+# and activity live in sqlite, so nothing is lost across a restart.
+CARRIER_ROLES = {"Kuudra Carrier", "Slayer Carrier", "Dungeon Carrier"}
+DISPATCH_OFFER_SECONDS = int(os.environ.get("DISPATCH_OFFER_SECONDS", "300"))  # 0 pings the role as before
+LOAD_WEIGHT = 1.0          # per open or offered ticket
+ACTIVITY_WEIGHT = 2.0      # penalty for a long-idle carrier; levels off instead of growing
+ACTIVITY_HALFLIFE = 1800.0 # idle time that costs half of ACTIVITY_WEIGHT
+RATING_WEIGHT = 0.5        # per star above/below 3
+RATING_PRIOR = (3.0, 3)    # average and weight blended into few-ratings carriers
+
+class CarrierDispatcher:
+    def __init__(self):
+        self.tickets: dict = {}                    # channel id → ticket state
+        self.last_seen: dict = {}
+        self._persisted_seen: dict = {}
+
+    def load_state(self):
+        self.tickets.clear()
+        self.last_seen.clear()
+        self._persisted_seen.clear()
+        cursor.execute("SELECT user_id, last_seen FROM carrier_activity")
+        for uid, ts in cursor.fetchall():
+            self.last_seen[int(uid)] = self._persisted_seen[int(uid)] = ts
+        cursor.execute("""
+            SELECT channel_id, carry_type, opener_id, offered_to, claimed_by, deadline_ts, escalated
+            FROM dispatch_tickets
+        """)
+        for cid, carry_type, opener, offered, claimed, deadline, escalated in cursor.fetchall():
+            self.tickets[int(cid)] = {
+                "carry_type": carry_type,
+                "opener": int(opener),
+                "offered_to": int(offered) if offered else None,
+                "claimed_by": int(claimed) if claimed else None,
+                "deadline": deadline,
+                "escalated": bool(escalated),
+            }
+
+    def loads(self) -> Counter:
+        """Claimed tickets plus offers still waiting on an answer, per carrier."""
+        counts = Counter()
+        for t in self.tickets.values():
+            if t["claimed_by"] is not None:
+                counts[t["claimed_by"]] += 1
+            elif not t["escalated"] and t["offered_to"] is not None:
+                counts[t["offered_to"]] += 1
+        return counts
+
+    def score(self, carrier_id: int, load: int, now: float) -> float:
+        """Lower is better."""
+        cursor.execute("SELECT stars, ratings FROM xp WHERE user_id = ?", (str(carrier_id),))
+        stars, ratings = cursor.fetchone() or (0, 0)
+        prior_avg, prior_n = RATING_PRIOR
+        rating = (stars + prior_avg * prior_n) / (ratings + prior_n)
+        seen = self.last_seen.get(carrier_id)
+        # never seen since activity tracking started → neutral, not worst
+        idle = now - seen if seen is not None else ACTIVITY_HALFLIFE
+        inactivity = 1 - 0.5 ** (idle / ACTIVITY_HALFLIFE)
+        return (LOAD_WEIGHT * load
+                + ACTIVITY_WEIGHT * inactivity
+                - RATING_WEIGHT * (rating - 3.0))
+
+    def pick(self, role: discord.Role, exclude=()):
+        """Best carrier holding `role`, or None if nobody is eligible."""
+        loads = self.loads()
+        now = time.time()
+        candidates = [m for m in role.members if not m.bot and m.id not in exclude]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda m: self.score(m.id, loads[m.id], now))
+
+    def _save(self, channel_id: int):
+        t = self.tickets[channel_id]
+        cursor.execute("""
+            UPDATE dispatch_tickets SET claimed_by = ?, escalated = ?, responded_ts = COALESCE(responded_ts, ?)
+            WHERE channel_id = ?
+        """, (
+            str(t["claimed_by"]) if t["claimed_by"] else None, int(t["escalated"]),
+            time.time() if t["claimed_by"] else None, str(channel_id)
+        ))
+        conn.commit()
+
+    def open_ticket(self, channel_id: int, carry_type: str, opener_id: int, carrier_id: int):
+        now = time.time()
+        self.tickets[channel_id] = {
+            "carry_type": carry_type,
+            "opener": opener_id,
+            "offered_to": carrier_id,
+            "claimed_by": None,
+            "deadline": now + DISPATCH_OFFER_SECONDS,
+            "escalated": False,
+        }
+        cursor.execute("""
+            INSERT OR REPLACE INTO dispatch_tickets
+                (channel_id, carry_type, opener_id, offered_to, created_ts, deadline_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (str(channel_id), carry_type, str(opener_id), str(carrier_id), now, now + DISPATCH_OFFER_SECONDS))
+        conn.commit()
+
+    def claim(self, channel_id: int, carrier_id: int):
+        t = self.tickets.get(channel_id)
+        if t is None or t["claimed_by"] is not None:
+            return
+        t["claimed_by"] = carrier_id
+        self._save(channel_id)
+
+    def escalated(self, channel_id: int):
+        t = self.tickets[channel_id]
+        t["escalated"] = True
+        self._save(channel_id)
+
+    def close_ticket(self, channel_id: int):
+        if self.tickets.pop(channel_id, None) is None:
+            return
+        cursor.execute("DELETE FROM dispatch_tickets WHERE channel_id = ?", (str(channel_id),))
+        conn.commit()
+
+    def mark_seen(self, carrier_id: int):
+        now = time.time()
+        self.last_seen[carrier_id] = now
+        # activity only matters at minute resolution; don't write on every message
+        if now - self._persisted_seen.get(carrier_id, 0) >= 60:
+            self._persisted_seen[carrier_id] = now
+            cursor.execute(
+                "INSERT INTO carrier_activity (user_id, last_seen) VALUES (?, ?) "
+                "ON CONFLICT (user_id) DO UPDATE SET last_seen = excluded.last_seen",
+                (str(carrier_id), now)
+            )
+            conn.commit()
+
+    def due(self) -> list[int]:
+        now = time.time()
+        return [
+            cid for cid, t in self.tickets.items()
+            if t["claimed_by"] is None and not t["escalated"] and t["deadline"] <= now
+        ]
+
+dispatcher = CarrierDispatcher()
+dispatcher.load_state()
+
+@bot.listen("on_message")
+async def on_message_dispatch(message: discord.Message):
+    if message.author.bot or not message.guild or not isinstance(message.author, discord.Member):
+        return
+    if not any(r.name in CARRIER_ROLES for r in message.author.roles):
+        return
+    dispatcher.mark_seen(message.author.id)
+    ticket = dispatcher.tickets.get(message.channel.id)
+    if ticket and message.author.id != ticket["opener"] \
+            and any(r.name == ticket["carry_type"] for r in message.author.roles):
+        dispatcher.claim(message.channel.id, message.author.id)
+
+@bot.listen("on_guild_channel_delete")
+async def on_ticket_channel_delete(channel: discord.abc.GuildChannel):
+    dispatcher.close_ticket(channel.id)
+
+@tasks.loop(seconds=15)
+async def dispatch_loop():
+    guild = bot.get_guild(GUILD_ID)
+    if guild is None:
+        return
+    for channel_id in dispatcher.due():
+        ticket = dispatcher.tickets[channel_id]
+        channel = guild.get_channel(channel_id)
+        if channel is None:
+            dispatcher.close_ticket(channel_id)
+            continue
+        role = get(guild.roles, name=ticket["carry_type"])
+        dispatcher.escalated(channel_id)
+        if role:
+            offered = guild.get_member(ticket["offered_to"]) if ticket["offered_to"] else None
+            who = offered.display_name if offered else "the first carrier"
+            await channel.send(f"{role.mention} no response from {who} yet — this ticket is open to everyone.")
+
+@dispatch_loop.before_loop
+async def before_dispatch():
+    await bot.wait_until_ready()
+    guild = bot.get_guild(GUILD_ID)
+    if guild:
+        # tickets closed while we were offline
+        for channel_id in [c for c in dispatcher.tickets if guild.get_channel(c) is None]:
+            dispatcher.close_ticket(channel_id)
+
 # --- UI Components ---
 class TierSelect(discord.ui.Select):
     def __init__(self, category_label: str, user: discord.Member, container: discord.TextChannel):
@@ -198,7 +827,8 @@ class TierSelect(discord.ui.Select):
 
 class TicketButton(discord.ui.Button):
     def __init__(self, label: str, style: discord.ButtonStyle, handler: str):
-        super().__init__(label=label, style=style)
+        # stable custom_id so panels keep working across restarts
+        super().__init__(label=label, style=style, custom_id=f"ticket:{handler}:{label.lower()}")
         self.handler = handler
 
     async def callback(self, interaction: discord.Interaction):
@@ -221,6 +851,70 @@ class TicketButton(discord.ui.Button):
             )
             await interaction.response.send_message(f"Ticket created: {ticket.mention}", ephemeral=True)
 
+class VerifyButton(discord.ui.Button):
+    def __init__(self):
+        super().__init__(label="Verify", style=discord.ButtonStyle.success, custom_id="panel:verify")
+
+    async def callback(self, interaction: discord.Interaction):
+        # instead of immediately responding, pop up our modal:
+        await interaction.response.send_modal(VerifyModal())
+
+class ApplyButton(discord.ui.Button):
+    def __init__(self):
+        super().__init__(label="Apply", style=discord.ButtonStyle.success, custom_id="panel:apply")
+
+    async def callback(self, interaction: discord.Interaction):
+        user = interaction.user
+        category = interaction.channel.category
+        channel_name = f"application-{user.name.lower()}"
+        ticket = await category.create_text_channel(channel_name)
+        guild = ticket.guild
+        await ticket.set_permissions(guild.default_role, read_messages=False)
+        maint_role = await get_or_create_role(guild, "Maintenance")
+        await ticket.set_permissions(maint_role, read_messages=True, send_messages=True)
+        await ticket.set_permissions(user, read_messages=True, send_messages=True)
+
+        await ticket.send(
+            f"{maint_role.mention} {user.mention} opened an application ticket."
+        )
+        await ticket.send(
+            f"{user.mention}, please provide a screenshot showing that you meet the requirements."
+        )
+        await interaction.response.send_message(
+            f"Your application ticket has been created: {ticket.mention}", ephemeral=True
+        )
+
+PANEL_CATEGORIES = ["Verification", "Dungeons", "Kuudra", "Slayer", "Applications"]
+
+def panel_view(category: str) -> discord.ui.View:
+    """The persistent button view for a panel category."""
+    view = discord.ui.View(timeout=None)
+
+    if category == "Dungeons":
+        for label in [f"F{i}" for i in range(1, 8)] + [f"M{i}" for i in range(1, 8)]:
+            style = discord.ButtonStyle.success if label.startswith("F") else discord.ButtonStyle.danger
+            view.add_item(TicketButton(label, style, handler="dungeon"))
+
+    elif category == "Slayer":
+        for label in ["Zombie", "Spider", "Enderman", "Wolf", "Blaze", "Vampire"]:
+            view.add_item(TicketButton(label, discord.ButtonStyle.blurple, handler="slayer"))
+
+    elif category == "Kuudra":
+        for label in ["Basic", "Hot", "Burning", "Fiery", "Infernal"]:
+            view.add_item(TicketButton(label, discord.ButtonStyle.danger, handler="kuudra"))
+
+    elif category == "Verification":
+        view.add_item(VerifyButton())
+
+    elif category == "Applications":
+        view.add_item(ApplyButton())
+
+    return view
+
+def register_panel_views(client: commands.Bot):
+    for category in PANEL_CATEGORIES:
+        client.add_view(panel_view(category))
+
 class PanelModal(discord.ui.Modal):
     def __init__(self, category: str):
         super().__init__(title=f"{category} Panel Message")
@@ -231,55 +925,7 @@ class PanelModal(discord.ui.Modal):
     async def on_submit(self, interaction: discord.Interaction):
         await interaction.response.send_message("Panel created.", ephemeral=True)
         await interaction.channel.send(self.body.value)
-        view = discord.ui.View(timeout=None)
-
-        if self.category == "Dungeons":
-            for label in [f"F{i}" for i in range(1, 8)] + [f"M{i}" for i in range(1, 8)]:
-                style = discord.ButtonStyle.success if label.startswith("F") else discord.ButtonStyle.danger
-                view.add_item(TicketButton(label, style, handler="dungeon"))
-
-        elif self.category == "Slayer":
-            for label in ["Zombie", "Spider", "Enderman", "Wolf", "Blaze", "Vampire"]:
-                view.add_item(TicketButton(label, discord.ButtonStyle.blurple, handler="slayer"))
-
-        elif self.category == "Kuudra":
-            for label in ["Basic", "Hot", "Burning", "Fiery", "Infernal"]:
-                view.add_item(TicketButton(label, discord.ButtonStyle.danger, handler="kuudra"))
-
-        elif self.category == "Verification":
-            button = discord.ui.Button(label="Verify", style=discord.ButtonStyle.success)
-            async def verify_callback(inter: discord.Interaction):
-                # instead of immediately responding, pop up our modal:
-                await inter.response.send_modal(VerifyModal())
-            button.callback = verify_callback
-            view.add_item(button)
-
-        elif self.category == "Applications":
-            button = discord.ui.Button(label="Apply", style=discord.ButtonStyle.success)
-            async def apply_callback(inter: discord.Interaction):
-                user = inter.user
-                category = inter.channel.category
-                channel_name = f"application-{user.name.lower()}"
-                ticket = await category.create_text_channel(channel_name)
-                guild = ticket.guild
-                await ticket.set_permissions(guild.default_role, read_messages=False)
-                maint_role = await get_or_create_role(guild, "Maintenance")
-                await ticket.set_permissions(maint_role, read_messages=True, send_messages=True)
-                await ticket.set_permissions(user, read_messages=True, send_messages=True)
-
-                await ticket.send(
-                    f"{maint_role.mention} {user.mention} opened an application ticket."
-                )
-                await ticket.send(
-                    f"{user.mention}, please provide a screenshot showing that you meet the requirements."
-                )
-                await inter.response.send_message(
-                    f"Your application ticket has been created: {ticket.mention}", ephemeral=True
-                )
-            button.callback = apply_callback
-            view.add_item(button)
-
-        await interaction.channel.send(view=view)
+        await interaction.channel.send(view=panel_view(self.category))
 
 class ConfirmCloseAll(discord.ui.View):
     def __init__(self, user: discord.Member):
@@ -320,7 +966,7 @@ class ConfirmCloseAll(discord.ui.View):
 
         if now_ts - last_ts >= 60:
             xp += 5
-            update_user(uid, xp, now_ts)
+            update_user(uid, xp, now_ts, 5, "chat")
             await apply_xp_roles(message.author, xp)
 
         await bot.process_commands(message)
@@ -328,8 +974,7 @@ class ConfirmCloseAll(discord.ui.View):
 # --- Slash Commands ---
 @tree.command(name="finish", description="Finish a ticket and request rating", guild=discord.Object(id=GUILD_ID))
 async def finish_command(interaction: discord.Interaction):
-    carrier_roles = {"Kuudra Carrier", "Slayer Carrier", "Dungeon Carrier"}
-    if not any(r.name in carrier_roles for r in interaction.user.roles):
+    if not any(r.name in CARRIER_ROLES for r in interaction.user.roles):
         return await interaction.response.send_message(
             "❌ You must have a Carrier role to finish this ticket.", ephemeral=True
         )
@@ -339,10 +984,13 @@ async def finish_command(interaction: discord.Interaction):
             "❌ This command can only be used in a ticket channel.", ephemeral=True
         )
 
+    dispatcher.claim(interaction.channel.id, interaction.user.id)
+    dispatcher.mark_seen(interaction.user.id)
+
     cid = str(interaction.user.id)
     xp, last = get_user(cid)
     xp += 100
-    update_user(cid, xp, last)
+    update_user(cid, xp, last, 100, "finish")
     await apply_xp_roles(interaction.user, xp)
 
     # 4) Build a View with 1–5 star buttons
@@ -518,7 +1166,72 @@ async def giveaway_command(interaction: discord.Interaction, time: str, prize: s
 async def xp_command(interaction: discord.Interaction):
      uid = str(interaction.user.id)
      xp_val, _ = get_user(uid)
-     await interaction.response.send_message(f"🎖️ You have **{xp_val}** XP!", ephemeral=True)
+     week, month = period_xp(uid, "week"), period_xp(uid, "month")
+     await interaction.response.send_message(
+         f"🎖️ You have **{xp_val}** XP! (**{week}** this week, **{month}** this month)", ephemeral=True
+     )
+
+@tree.command(name="leaderboard", description="Top XP earners this day, week or month", guild=discord.Object(id=GUILD_ID))
+@app_commands.describe(period="Which period to rank")
+@app_commands.choices(period=[
+    app_commands.Choice(name="Today", value="day"),
+    app_commands.Choice(name="This week", value="week"),
+    app_commands.Choice(name="This month", value="month"),
+])
+async def leaderboard_command(interaction: discord.Interaction, period: app_commands.Choice[str]):
+    rows = period_leaderboard(period.value)
+    if not rows:
+        return await interaction.response.send_message(f"No XP earned {period.name.lower()} yet.", ephemeral=True)
+    lines = [f"**{i}.** <@{uid}> — {xp} XP" for i, (uid, xp) in enumerate(rows, start=1)]
+    await interaction.response.send_message(
+        f"🏆 **XP leaderboard — {period.name}**\n" + "\n".join(lines),
+        allowed_mentions=discord.AllowedMentions.none()
+    )
+
+@tree.command(name="guildstats", description="Guild EXP totals and trends", guild=discord.Object(id=GUILD_ID))
+@app_commands.describe(days="Window in days (default 7)", player="Minecraft name for per-member stats")
+async def guildstats_command(
+    interaction: discord.Interaction,
+    days: app_commands.Range[int, 1, 365] = 7,
+    player: str = None
+):
+    if player:
+        await interaction.response.defer(ephemeral=True)
+        try:
+            uuid = await upstream.get_uuid(player)
+        except UpstreamError:
+            return await interaction.followup.send("❌ Mojang API error, try again later.", ephemeral=True)
+        if uuid is None:
+            return await interaction.followup.send("❌ Could not find that Minecraft user.", ephemeral=True)
+        stats = member_gexp_stats(uuid, days)
+        if not stats["total"] and not stats["previous"]:
+            return await interaction.followup.send(f"No guild EXP recorded for **{player}**.", ephemeral=True)
+        return await interaction.followup.send(
+            f"📈 **{player}** — last {days} day(s): **{stats['total']:,}** GEXP "
+            f"(**{stats['total'] // days:,}**/day, active {stats['active_days']} day(s))\n"
+            f"{trend(stats['total'], stats['previous'])}",
+            ephemeral=True
+        )
+
+    stats = guild_gexp_stats(days)
+    if not stats["days"]:
+        return await interaction.response.send_message("No guild EXP recorded yet.", ephemeral=True)
+    best_day, best_total, _ = stats["best"]
+    best = datetime.strptime(str(best_day), "%Y%m%d").strftime("%Y-%m-%d")
+    await interaction.response.send_message(
+        f"📈 **{GUILD_NAME}** — last {days} day(s) ({stats['days']} with data): "
+        f"**{stats['total']:,}** GEXP (**{stats['total'] // stats['days']:,}**/day)\n"
+        f"Average active members: **{stats['avg_active']:.1f}** · Best day: {best} ({best_total:,})\n"
+        f"{trend(stats['total'], stats['previous'])}",
+        ephemeral=True
+    )
+
+@tree.command(name="rebuildxp", description="Recompute XP totals from the XP ledger", guild=discord.Object(id=GUILD_ID))
+async def rebuildxp_command(interaction: discord.Interaction):
+    if not interaction.user.guild_permissions.administrator:
+        return await interaction.response.send_message("Admins only.", ephemeral=True)
+    fixed = rebuild_xp_totals()
+    await interaction.response.send_message(f"✅ Rebuilt XP totals; {fixed} user(s) had drifted.", ephemeral=True)
 
 class VerifyModal(discord.ui.Modal):
   def __init__(self):
@@ -534,22 +1247,21 @@ class VerifyModal(discord.ui.Modal):
       mc_name = self.username.value.strip()
       await interaction.response.defer(ephemeral=True)
 
-      async with aiohttp.ClientSession() as sess:
-          mojang = await sess.get(f"https://api.mojang.com/users/profiles/minecraft/{mc_name}")
-          if mojang.status != 200:
-              return await interaction.followup.send("❌ Could not find that Minecraft user.")
-          uuid = (await mojang.json())["id"]
-
-          guild_resp = await sess.get(
-              "https://api.hypixel.net/guild",
-              params={"key": HYPIXEL_KEY, "name": "Sky Sanctuary"}
-          )
-          data = await guild_resp.json()
-          if not data.get("success"):
-              return await interaction.followup.send("❌ Hypixel API error, try again later.")
+      try:
+          uuid = await upstream.get_uuid(mc_name)
+      except UpstreamError:
+          return await interaction.followup.send("❌ Mojang API error, try again later.")
+      if uuid is None:
+          return await interaction.followup.send("❌ Could not find that Minecraft user.")
+      try:
+          # no history store here: verify is the busiest modal and the sync
+          # loops already keep gexp_daily current
+          hypixel_guild = await upstream.get_guild(GUILD_NAME)
+      except UpstreamError:
+          return await interaction.followup.send("❌ Hypixel API error, try again later.")
 
-          members = data["guild"].get("members", [])
-          in_sanctuary = any(m["uuid"] == uuid for m in members)
+      members = hypixel_guild.get("members", [])
+      in_sanctuary = any(m["uuid"] == uuid for m in members)
 
       role_name = "Guild Member" if in_sanctuary else "Guest"
       opposite  = "Guest" if in_sanctuary else "Guild Member"
@@ -571,26 +1283,23 @@ class VerifyModal(discord.ui.Modal):
   description="Manually sync Hypixel guild XP and roles",
   guild=discord.Object(id=GUILD_ID)
 )
-async def updatexp_command(inter: discord.Interaction):  maint = await get_or_create_role(inter.guild, "Maintenance")
+async def updatexp_command(inter: discord.Interaction):
+  maint = await get_or_create_role(inter.guild, "Maintenance")
   if maint not in inter.user.roles and not inter.user.guild_permissions.administrator:
       return await inter.response.send_message("❌ You don’t have permission to run this.", ephemeral=True)
 
   await inter.response.defer(ephemeral=True)
 
-  async with aiohttp.ClientSession() as sess:
-      resp = await sess.get(
-          "https://api.hypixel.net/guild",
-          params={"key": HYPIXEL_KEY, "name": "Sky Sanctuary"}
-      )
-      data = await resp.json()
-      if not data.get("success"):
-          return await inter.followup.send("❌ Hypixel API error – could not fetch guild.", ephemeral=True)
+  try:
+      hypixel_guild = await fetch_guild()
+  except UpstreamError:
+      return await inter.followup.send("❌ Hypixel API error – could not fetch guild.", ephemeral=True)
 
-      today = datetime.utcnow().strftime("%Y-%m-%d")
-      roster_xp = {
-          m["uuid"]: m.get("expHistory", {}).get(today, 0)
-          for m in data["guild"].get("members", [])
-      }
+  today = datetime.utcnow().strftime("%Y-%m-%d")
+  roster_xp = {
+      m["uuid"]: m.get("expHistory", {}).get(today, 0)
+      for m in hypixel_guild.get("members", [])
+  }
 
   guild_role = discord.utils.get(inter.guild.roles, name="Guild Member")
   guest_role = discord.utils.get(inter.guild.roles, name="Guest") \
@@ -599,21 +1308,25 @@ async def updatexp_command(inter: discord.Interaction):  maint = await get_or_cr
       return await inter.followup.send("⚠️ No “Guild Member” role found on this server.", ephemeral=True)
 
   demoted = 0
+  skipped = 0
   xp_awarded = 0
 
   for member in list(guild_role.members):
       mc_name = member.nick or member.name
 
-      async with aiohttp.ClientSession() as sess:
-          mj = await sess.get(f"https://api.mojang.com/users/profiles/minecraft/{mc_name}")
-      if mj.status != 200:
+      try:
+          uuid = await upstream.get_uuid(mc_name)
+      except UpstreamError:
+          # Mojang is down, not the member's fault → leave them alone
+          skipped += 1
+          continue
+      if uuid is None:
           # invalid name → demote
           await member.remove_roles(guild_role)
           await member.add_roles(guest_role)
           demoted += 1
           continue
 
-      uuid = (await mj.json())["id"]
       earned = roster_xp.get(uuid)
 
       if earned is None:
@@ -625,12 +1338,13 @@ async def updatexp_command(inter: discord.Interaction):  maint = await get_or_cr
           if bonus > 0:
               old_xp, last_ts = get_user(str(member.id))
               new_xp = old_xp + bonus
-              update_user(str(member.id), new_xp, last_ts)
+              update_user(str(member.id), new_xp, last_ts, bonus, "hypixel")
               await apply_xp_roles(member, new_xp)
               xp_awarded += bonus
 
   await inter.followup.send(
-      f"✅ Update complete: demoted **{demoted}** users, awarded **{xp_awarded}** XP total.",
+      f"✅ Update complete: demoted **{demoted}** users, awarded **{xp_awarded}** XP total."
+      + (f" Skipped **{skipped}** users (Mojang unavailable)." if skipped else ""),
       ephemeral=True
   )
 @tree.command(
@@ -671,53 +1385,84 @@ async def setup_command(interaction: discord.Interaction):
       except FileNotFoundError:
           continue
 
-      view = discord.ui.View(timeout=None)
-      if category == "Slayer":
-          for label in ["Zombie","Spider","Enderman","Wolf","Blaze","Vampire"]:
-              view.add_item(TicketButton(label, discord.ButtonStyle.blurple, handler="slayer"))
-
-      elif category == "Dungeons":
-          for label in [f"F{i}" for i in range(1,8)] + [f"M{i}" for i in range(1,8)]:
-              style = discord.ButtonStyle.success if label.startswith("F") else discord.ButtonStyle.danger
-              view.add_item(TicketButton(label, style, handler="dungeon"))
-
-      elif category == "Kuudra":
-          for label in ["Basic","Hot","Burning","Fiery","Infernal"]:
-              view.add_item(TicketButton(label, discord.ButtonStyle.danger, handler="kuudra"))
-
-      elif category == "Verification":
-          button = discord.ui.Button(label="Verify", style=discord.ButtonStyle.success)
-          async def verify_cb(inter: discord.Interaction):
-              await inter.response.send_modal(VerifyModal())
-          button.callback = verify_cb
-          view.add_item(button)
-
-      elif category == "Applications":
-          button = discord.ui.Button(label="Apply", style=discord.ButtonStyle.success)
-          async def apply_cb(inter: discord.Interaction):
-              user = inter.user
-              ticket_name = f"application-{user.name.lower()}"
-              ticket = await inter.channel.category.create_text_channel(ticket_name)
-              guild = ticket.guild
-              await ticket.set_permissions(guild.default_role, read_messages=False)
-              maint_role = await get_or_create_role(guild, "Maintenance")
-              await ticket.set_permissions(maint_role, read_messages=True, send_messages=True)
-              await ticket.set_permissions(user, read_messages=True, send_messages=True)
-              await ticket.send(f"{maint_role.mention} {user.mention} opened an application ticket.")
-              await ticket.send(f"{user.mention}, please provide a screenshot showing you meet the requirements.")
-              await inter.response.send_message(
-                  f"✅ Your application ticket is {ticket.mention}",
-                  ephemeral=True
-              )
-          button.callback = apply_cb
-          view.add_item(button)
-
-      await channel.send(body, view=view)
+      await channel.send(body, view=panel_view(category))
 
   await interaction.followup.send("✅ Setup complete.", ephemeral=True)
 
 
+@tree.command(name="profile", description="Sample the event loop and write a flamegraph file", guild=discord.Object(id=GUILD_ID))
+@app_commands.describe(seconds="How long to sample (1-60)")
+async def profile_command(interaction: discord.Interaction, seconds: app_commands.Range[int, 1, 60] = 10):
+    if not interaction.user.guild_permissions.administrator:
+        return await interaction.response.send_message("Admins only.", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(PROFILE_DIR, f"profile-{stamp}.folded")
+    samples = await asyncio.to_thread(loop_monitor.profile, seconds, path)
+    await interaction.followup.send(
+        f"🔥 Profiled {seconds}s ({samples} samples) → `{path}`\n"
+        f"Loop lag: last **{loop_monitor.last_lag * 1000:.0f}ms**, max **{loop_monitor.max_lag * 1000:.0f}ms**, "
+        f"{loop_monitor.stalls} stall(s) logged.",
+        ephemeral=True
+    )
+
+
+async def backup_autocomplete(interaction: discord.Interaction, current: str):
+    names = sorted((os.path.basename(p) for p in glob.glob(os.path.join(BACKUP_DIR, "*.db.gz"))), reverse=True)
+    return [app_commands.Choice(name=n, value=n) for n in names if current in n][:25]
+
+@tree.command(name="restoredb", description="Restore xp.db from a backup", guild=discord.Object(id=GUILD_ID))
+@app_commands.describe(backup="Backup file to restore")
+@app_commands.autocomplete(backup=backup_autocomplete)
+async def restoredb_command(interaction: discord.Interaction, backup: str):
+    if not interaction.user.guild_permissions.administrator:
+        return await interaction.response.send_message("Admins only.", ephemeral=True)
+    path = os.path.join(BACKUP_DIR, os.path.basename(backup))
+    if not os.path.isfile(path):
+        return await interaction.response.send_message("Backup not found.", ephemeral=True)
+    await interaction.response.defer(ephemeral=True)
+
+    try:
+        verified = await asyncio.to_thread(check_backup, path)
+    except (ValueError, OSError) as e:
+        return await interaction.followup.send(f"❌ {e}", ephemeral=True)
+
+    safety = None
+    restored = False
+    try:
+        # keep what we're about to overwrite, then copy the verified snapshot
+        # into the live connection so every handler sees it immediately
+        safety = await asyncio.to_thread(write_backup, "pre-restore")
+        await asyncio.to_thread(restore_backup, verified)
+        restored = True
+        # the snapshot may predate newer tables, and in-memory state still
+        # reflects the data we just replaced
+        init_schema()
+        dispatcher.load_state()
+    except (OSError, sqlite3.Error) as e:
+        print(f"Database restore from {path} failed: {e!r}")
+        if not restored:
+            if safety and os.path.exists(safety):
+                os.remove(safety)  # live data is unchanged, nothing to keep
+            return await interaction.followup.send(f"❌ Restore failed: {e}", ephemeral=True)
+        return await interaction.followup.send(
+            f"⚠️ Restored, but setting up the schema failed: {e}. Restart the bot. "
+            f"Previous data saved to `{safety}`.", ephemeral=True
+        )
+    finally:
+        os.remove(verified)
+    await interaction.followup.send(
+        f"✅ Restored from `{os.path.basename(path)}`. Previous data saved to `{safety}`.", ephemeral=True
+    )
+
+
 # --- Event Listeners ---
+if recorder:
+    @bot.listen("on_socket_raw_receive")
+    async def record_traffic(msg):
+        recorder.record(msg)
+
 @bot.event
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
     if payload.user_id == bot.user.id or payload.message_id not in giveaway_claims:
@@ -764,20 +1509,16 @@ async def daily_guild_check():
     if guild_obj is None:
         return
 
-    async with aiohttp.ClientSession() as sess:
-        resp = await sess.get(
-            "https://api.hypixel.net/guild",
-            params={"key": HYPIXEL_KEY, "name": "Sky Sanctuary"}
-        )
-        data = await resp.json()
-        if not data.get("success"):
-            return
-        # build a map uuid → XP earned today
-        today = datetime.utcnow().strftime("%Y-%m-%d")
-        roster_xp = {
-            m["uuid"]: m.get("expHistory", {}).get(today, 0)
-            for m in data["guild"].get("members", [])
-        }
+    try:
+        hypixel_guild = await fetch_guild()
+    except UpstreamError:
+        return
+    # build a map uuid → XP earned today
+    today = datetime.utcnow().strftime("%Y-%m-%d")
+    roster_xp = {
+        m["uuid"]: m.get("expHistory", {}).get(today, 0)
+        for m in hypixel_guild.get("members", [])
+    }
 
     guild_role = discord.utils.get(guild_obj.roles, name="Guild Member")
     guest_role = discord.utils.get(guild_obj.roles, name="Guest") or \
@@ -789,14 +1530,16 @@ async def daily_guild_check():
         # use their nickname if set, otherwise their username
         mc_name = member.nick or member.name
 
-        async with aiohttp.ClientSession() as sess:
-            mj = await sess.get(f"https://api.mojang.com/users/profiles/minecraft/{mc_name}")
-            if mj.status != 200:
-                # bad name → demote immediately
-                await member.remove_roles(guild_role)
-                await member.add_roles(guest_role)
-                continue
-            uuid = (await mj.json())["id"]
+        try:
+            uuid = await upstream.get_uuid(mc_name)
+        except UpstreamError:
+            # Mojang is down → don't demote anyone for it
+            continue
+        if uuid is None:
+            # bad name → demote immediately
+            await member.remove_roles(guild_role)
+            await member.add_roles(guest_role)
+            continue
 
         earned = roster_xp.get(uuid)
         if earned is None:
@@ -809,7 +1552,7 @@ async def daily_guild_check():
             if bonus > 0:
                 old_xp, last_ts = get_user(str(member.id))
                 new_xp = old_xp + bonus
-                update_user(str(member.id), new_xp, last_ts)
+                update_user(str(member.id), new_xp, last_ts, bonus, "hypixel")
                 await apply_xp_roles(member, new_xp)
 
 @daily_guild_check.before_loop
@@ -817,13 +1560,142 @@ async def wait_ready():
     await bot.wait_until_ready()
 
 
+# --- Database Backups ---
+# Online snapshots via SQLite's backup API, copied a few pages at a time from
+# a separate connection in a worker thread so handlers never wait on it.
+BACKUP_DIR = os.environ.get("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.environ.get("BACKUP_KEEP", "14"))
+BACKUP_PAGES_PER_STEP = 64
+
+def _snapshot_db(dest: str):
+    """Copy the live database into `dest` without holding long locks."""
+    src = sqlite3.connect(DB_PATH, timeout=30)
+    dst = sqlite3.connect(dest)
+    try:
+        with dst:
+            src.backup(dst, pages=BACKUP_PAGES_PER_STEP, sleep=0.005)
+    finally:
+        dst.close()
+        src.close()
+
+def _compress(path: str) -> str:
+    with open(path, "rb") as f_in, gzip.open(path + ".gz", "wb", compresslevel=6) as f_out:
+        shutil.copyfileobj(f_in, f_out)
+    os.remove(path)
+    return path + ".gz"
+
+def _prune_backups():
+    for prefix in ("xp-", "xp-compact-", "pre-restore-"):
+        snapshots = sorted(
+            p for p in glob.glob(os.path.join(BACKUP_DIR, f"{prefix}*.db.gz"))
+            if os.path.basename(p)[len(prefix):][:1].isdigit()
+        )
+        for old in snapshots[:-BACKUP_KEEP]:
+            os.remove(old)
+
+def write_backup(prefix: str = "xp") -> str:
+    """Write a timestamped, gzipped snapshot and apply retention. Blocking."""
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+    path = os.path.join(BACKUP_DIR, f"{prefix}-{stamp}.db")
+    _snapshot_db(path)
+    path = _compress(path)
+    _prune_backups()
+    return path
+
+def run_db_maintenance() -> str:
+    """Checkpoint the WAL, refresh planner stats and, if a lot of the file is
+    free pages, write a compacted copy with VACUUM INTO. Blocking."""
+    maint = sqlite3.connect(DB_PATH, timeout=30)
+    try:
+        busy, wal_pages, moved = maint.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        maint.execute("ANALYZE")
+        maint.commit()
+        free = maint.execute("PRAGMA freelist_count").fetchone()[0]
+        total = maint.execute("PRAGMA page_count").fetchone()[0]
+        summary = f"checkpointed {moved}/{wal_pages} WAL pages, analyzed, {free}/{total} pages free"
+        if total and free / total > 0.2:
+            os.makedirs(BACKUP_DIR, exist_ok=True)
+            stamp = datetime.now(timezone.utc).strftime("%Y%m%d-%H%M%S")
+            compact = os.path.join(BACKUP_DIR, f"xp-compact-{stamp}.db")
+            maint.execute("VACUUM INTO ?", (compact,))
+            summary += f", compacted copy at {_compress(compact)} (restore it to reclaim space)"
+            _prune_backups()
+        return summary
+    finally:
+        maint.close()
+
+def check_backup(path: str) -> str:
+    """Decompress a snapshot to a temp file and verify it. Returns the temp path."""
+    fd, tmp = tempfile.mkstemp(suffix=".db", dir=BACKUP_DIR)
+    os.close(fd)
+    opener = gzip.open if path.endswith(".gz") else open
+    try:
+        with opener(path, "rb") as f_in, open(tmp, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    except (OSError, EOFError, zlib.error) as e:
+        # truncated or corrupt archives surface as EOFError/zlib.error
+        os.remove(tmp)
+        raise ValueError(f"backup failed verification: {e}")
+    check = sqlite3.connect(tmp)
+    try:
+        result = check.execute("PRAGMA integrity_check").fetchone()[0]
+        has_xp = check.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'xp'").fetchone()
+    except sqlite3.DatabaseError as e:
+        result, has_xp = str(e), None
+    finally:
+        check.close()
+    if result != "ok" or not has_xp:
+        os.remove(tmp)
+        raise ValueError(f"backup failed verification: {result if result != 'ok' else 'no xp table'}")
+    return tmp
+
+def restore_backup(verified: str):
+    """Copy a verified snapshot over the live database. Blocking."""
+    # opened here: sqlite connections can only be used on the thread that made them
+    src = sqlite3.connect(verified)
+    try:
+        src.backup(conn)
+    finally:
+        src.close()
+
+@tasks.loop(hours=6)
+async def backup_loop():
+    try:
+        path = await asyncio.to_thread(write_backup)
+        print(f"Database backed up to {path}")
+    except (OSError, sqlite3.Error) as e:
+        print(f"Database backup failed: {e!r}")
+
+@tasks.loop(hours=24)
+async def maintenance_loop():
+    try:
+        print(f"Database maintenance: {await asyncio.to_thread(run_db_maintenance)}")
+    except (OSError, sqlite3.Error) as e:
+        print(f"Database maintenance failed: {e!r}")
+
+@backup_loop.before_loop
+@maintenance_loop.before_loop
+async def wait_ready_db():
+    await bot.wait_until_ready()
+
+
 @bot.event
 async def on_ready():
     guild = discord.Object(id=GUILD_ID)
     await bot.tree.sync(guild=guild)
     if not daily_guild_check.is_running():
       daily_guild_check.start()
+    if TICKET_POOL_MAX > 0 and not ticket_pool_loop.is_running():
+      ticket_pool_loop.start()
+    if not backup_loop.is_running():
+      backup_loop.start()
+    if not maintenance_loop.is_running():
+      maintenance_loop.start()
+    if DISPATCH_OFFER_SECONDS > 0 and not dispatch_loop.is_running():
+      dispatch_loop.start()
     print(f"Bot ready as {bot.user}")
 
 # --- Run Bot ---
-bot.run(TOKEN)
+if __name__ == "__main__":
+    bot.run(TOKEN)
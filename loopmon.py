@@ -0,0 +1,140 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+log = logging.getLogger("loopmon")
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    # collapsed-stack lines are space- and semicolon-delimited
+    label = f"{os.path.basename(code.co_filename)}:{code.co_name}"
+    return label.replace(" ", "_").replace(";", "_")
+
+
+def _walk(frame) -> list:
+    """Frames from outermost to innermost."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+class LoopMonitor:
+    """Measures event-loop scheduling delay and reports what is blocking it.
+
+    A coroutine ticks every `interval` seconds and records how late it woke
+    up. A watchdog thread watches those ticks; when the loop hasn't ticked
+    for longer than `threshold` it grabs the loop thread's stack, so the
+    blocking code is captured while it is still running."""
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.25, app_files=("bot.py",)):
+        self.interval = interval
+        self.threshold = threshold
+        self.app_files = set(app_files)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self.stalls = 0
+        self._heartbeat = time.monotonic()
+        self._loop = None
+        self._loop_thread = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        if self._task is not None:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(target=self._watch, name="loopmon", daemon=True)
+        self._watchdog.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _tick(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            self.last_lag = max(0.0, now - expected)
+            self.max_lag = max(self.max_lag, self.last_lag)
+            self._heartbeat = now
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._heartbeat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or reported == beat:
+                continue
+            # only report each stall once, at the moment it crosses the threshold
+            reported = beat
+            self.stalls += 1
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            task = asyncio.current_task(self._loop)
+            log.warning(
+                "event loop blocked for %.0fms in %s (task %s)\n%s",
+                stalled * 1000, self.describe(frame),
+                task.get_name() if task else "?", self.format_stack(frame),
+            )
+
+    def describe(self, frame) -> str:
+        """Name the outermost app handler and the innermost app call on the stack."""
+        frames = _walk(frame)
+        # only look below asyncio's Handle._run, i.e. inside the current callback
+        for i in range(len(frames) - 1, -1, -1):
+            code = frames[i].f_code
+            if code.co_name == "_run" and code.co_filename.endswith(os.path.join("asyncio", "events.py")):
+                frames = frames[i + 1:]
+                break
+        app = [f for f in frames if os.path.basename(f.f_code.co_filename) in self.app_files]
+        if not app:
+            return _frame_label(frame)
+        handler, inner = app[0], app[-1]
+        return f"{handler.f_code.co_name} ({_frame_label(inner)} line {inner.f_lineno})"
+
+    @staticmethod
+    def format_stack(frame, limit: int = 20) -> str:
+        frames = _walk(frame)[-limit:]
+        return "\n".join(
+            f"  {f.f_code.co_filename}:{f.f_lineno} in {f.f_code.co_name}" for f in frames
+        )
+
+    def profile(self, seconds: float, path: str, rate: float = 200.0) -> int:
+        """Sample the loop thread for `seconds` and write a collapsed-stack file.
+
+        Blocks the calling thread, so run it via asyncio.to_thread. The output
+        is one "frame;frame;frame count" line per stack, readable by
+        flamegraph.pl and speedscope. Returns the number of samples taken."""
+        if self._loop_thread is None:
+            raise RuntimeError("monitor is not started")
+        counts = Counter()
+        step = 1.0 / rate
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                counts[";".join(_frame_label(f) for f in _walk(frame))] += 1
+            time.sleep(step)
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, n in counts.most_common():
+                f.write(f"{stack} {n}\n")
+        return sum(counts.values())
@@ -0,0 +1,541 @@
+"""Replay a traffic log recorded with RECORD_TRAFFIC through bot.py's handlers.
+
+Discord REST calls are answered in-process and Mojang/Hypixel are served by a
+local fake, so nothing leaves the machine. xp.db is copied, never touched.
+
+    python replay.py traffic.jsonl.gz                    # as fast as possible
+    python replay.py traffic.jsonl.gz --speed 1 --rest-latency 0.08 --sync-every 600
+
+Prints handler latency percentiles, REST call volume by route, upstream call
+counts and how long the event loop spent blocked in sqlite.
+"""
+import argparse
+import asyncio
+import hashlib
+import itertools
+import os
+import re
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+from traffic import read_log
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q / 100 * len(values)))]
+
+
+class Stats:
+    def __init__(self):
+        self.latency = defaultdict(list)
+        self.errors = Counter()
+        self.rest = Counter()
+        self.upstream = Counter()
+        self.db = []
+        self.db_locked = 0
+
+    def report(self, events: int, wall: float) -> str:
+        lines = [f"replayed {events} events in {wall:.1f}s", ""]
+        lines.append(f"{'handler':<36}{'n':>7}{'p50ms':>9}{'p95ms':>9}{'p99ms':>9}{'maxms':>9}{'errors':>8}")
+        for name, samples in sorted(self.latency.items(), key=lambda kv: -len(kv[1])):
+            ms = [s * 1000 for s in samples]
+            lines.append(
+                f"{name:<36}{len(ms):>7}{percentile(ms, 50):>9.1f}{percentile(ms, 95):>9.1f}"
+                f"{percentile(ms, 99):>9.1f}{max(ms):>9.1f}{self.errors[name]:>8}"
+            )
+
+        parse_errors = {k: v for k, v in self.errors.items() if k.startswith("parse:")}
+        if parse_errors:
+            lines += ["", "unparseable events: " + ", ".join(f"{k[6:]} {v}" for k, v in parse_errors.items())]
+
+        lines += ["", f"REST calls: {sum(self.rest.values())}"]
+        for route, n in self.rest.most_common():
+            lines.append(f"  {n:>6}  {route}")
+
+        lines += ["", f"upstream calls: " + ", ".join(f"{k} {v}" for k, v in sorted(self.upstream.items()))]
+
+        db_ms = [s * 1000 for s in self.db]
+        lines += ["", (
+            f"sqlite: {len(db_ms)} calls, {sum(db_ms):.1f}ms blocking the loop "
+            f"({sum(db_ms) / 10 / max(wall, 1e-9):.2f}% of wall), p99 {percentile(db_ms, 99):.2f}ms, "
+            f"max {max(db_ms, default=0):.2f}ms, {self.db_locked} 'database is locked' errors"
+        )]
+        return "\n".join(lines)
+
+
+class Timed:
+    """Proxies a sqlite3 connection or cursor and times every call on it."""
+
+    def __init__(self, inner, stats: Stats):
+        self._inner = inner
+        self._stats = stats
+
+    def _timed(self, fn, *args):
+        t = time.perf_counter()
+        try:
+            result = fn(*args)
+        except sqlite3.OperationalError as e:
+            if "locked" in str(e):
+                self._stats.db_locked += 1
+            raise
+        finally:
+            self._stats.db.append(time.perf_counter() - t)
+        return Timed(result, self._stats) if isinstance(result, sqlite3.Cursor) else result
+
+    def execute(self, *args):
+        return self._timed(self._inner.execute, *args)
+
+    def executemany(self, *args):
+        return self._timed(self._inner.executemany, *args)
+
+    def commit(self):
+        return self._timed(self._inner.commit)
+
+    def cursor(self):
+        return Timed(self._inner.cursor(), self._stats)
+
+    def __iter__(self):
+        return iter(self._inner)
+
+    def __getattr__(self, name):
+        return getattr(self._inner, name)
+
+
+# --- Fake upstream (Mojang + Hypixel), served from its own thread ---
+def fake_uuid(name: str) -> str:
+    return hashlib.md5(name.lower().encode()).hexdigest()
+
+
+def start_fake_upstream(member_names, stats: Stats, latency: float) -> str:
+    today = datetime.now(timezone.utc).date()
+    members = [
+        {
+            "uuid": fake_uuid(name),
+            "expHistory": {
+                (today - timedelta(days=d)).strftime("%Y-%m-%d"): int(fake_uuid(name)[d:d + 4], 16) % 30000
+                for d in range(7)
+            },
+        }
+        for name in member_names
+    ]
+
+    async def mojang(request):
+        stats.upstream["mojang"] += 1
+        await asyncio.sleep(latency)
+        name = request.match_info["name"]
+        return web.json_response({"id": fake_uuid(name), "name": name})
+
+    async def guild(request):
+        stats.upstream["hypixel"] += 1
+        await asyncio.sleep(latency)
+        return web.json_response(
+            {"success": True, "guild": {"name": "Sky Sanctuary", "members": members}},
+            headers={"RateLimit-Remaining": "119", "RateLimit-Reset": "60"},
+        )
+
+    ready = threading.Event()
+    port = []
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        app = web.Application()
+        app.router.add_get("/users/profiles/minecraft/{name}", mojang)
+        app.router.add_get("/guild", guild)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        loop.run_until_complete(site.start())
+        port.append(site._server.sockets[0].getsockname()[1])
+        ready.set()
+        loop.run_forever()
+
+    threading.Thread(target=serve, name="fake-upstream", daemon=True).start()
+    ready.wait()
+    return f"http://127.0.0.1:{port[0]}"
+
+
+# --- Fake Discord REST ---
+class FakeDiscord:
+    """Answers discord.py's REST and webhook calls with minimal valid payloads
+    and feeds the resulting channel/role changes back into the cache, the way
+    the gateway would."""
+
+    def __init__(self, app, stats: Stats, latency: float):
+        self.app = app
+        self.stats = stats
+        self.latency = latency
+        self.ids = itertools.count(1 << 61)
+        # recorded CHANNEL_CREATE ids waiting to be paired with a channel we
+        # created under the same name, and vice versa
+        self.recorded_channels = defaultdict(deque)
+        self.created_channels = defaultdict(deque)
+        self.translate = {}
+
+    def new_id(self) -> str:
+        return str(next(self.ids))
+
+    @property
+    def state(self):
+        return self.app.bot._connection
+
+    def user(self) -> dict:
+        me = self.app.bot.user
+        return {"id": str(me.id), "username": me.name, "discriminator": "0", "avatar": None, "bot": True}
+
+    def message(self, channel_id, payload, message_id=None) -> dict:
+        payload = payload or {}
+        return {
+            "id": str(message_id or self.new_id()),
+            "channel_id": str(channel_id),
+            "author": self.user(),
+            "content": payload.get("content") or "",
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "edited_timestamp": None,
+            "tts": False,
+            "mention_everyone": False,
+            "mentions": [],
+            "mention_roles": [],
+            "attachments": [],
+            "embeds": payload.get("embeds") or [],
+            "components": payload.get("components") or [],
+            "pinned": False,
+            "type": 0,
+            "flags": payload.get("flags") or 0,
+        }
+
+    def channel(self, guild_id, payload, channel_id=None) -> dict:
+        existing = self.state.get_channel(int(channel_id)) if channel_id else None
+        data = {
+            "id": str(channel_id or self.new_id()),
+            "guild_id": str(guild_id),
+            "type": 0,
+            "name": existing.name if existing else "channel",
+            "position": existing.position if existing else 0,
+            "parent_id": str(existing.category_id) if existing and existing.category_id else None,
+            "permission_overwrites": [],
+            "nsfw": False,
+            "topic": None,
+        }
+        data.update({k: v for k, v in (payload or {}).items() if v is not None})
+        return data
+
+    async def request(self, route, **kwargs):
+        return await self._answer(route, kwargs.get("json"))
+
+    async def webhook_request(self, route, session=None, **kwargs):
+        return await self._answer(route, kwargs.get("payload"))
+
+    async def _answer(self, route, payload):
+        self.stats.rest[f"{route.method} {route.path}"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        method, path = route.method, route.path
+        ids = re.findall(r"\d{5,}", route.url.split("?")[0])
+
+        if path == "/guilds/{guild_id}/channels" and method == "POST":
+            data = self.channel(route.guild_id, payload)
+            self.state.parse_channel_create(data)
+            self.created(data)
+            return data
+        if path == "/channels/{channel_id}" and method == "PATCH":
+            data = self.channel(self.app.GUILD_ID, payload, route.channel_id)
+            if self.state.get_channel(int(route.channel_id)):
+                self.state.parse_channel_update(data)
+            return data
+        if path == "/channels/{channel_id}" and method == "DELETE":
+            channel = self.state.get_channel(int(route.channel_id))
+            if channel:
+                data = self.channel(channel.guild.id, None, channel.id)
+                self.state.parse_channel_delete(data)
+            return None
+        if path == "/channels/{channel_id}/messages" and method == "POST":
+            return self.message(route.channel_id, payload)
+        if path == "/channels/{channel_id}/messages/{message_id}" and method == "GET":
+            return self.message(route.channel_id, None, ids[-1])
+        if path == "/channels/{channel_id}/messages" and method == "GET":
+            return []
+        if path.startswith("/channels/{channel_id}/messages/{message_id}/reactions") and method == "GET":
+            return []
+        if path == "/guilds/{guild_id}/roles" and method == "POST":
+            data = {
+                "id": self.new_id(), "name": (payload or {}).get("name", "role"), "color": 0,
+                "hoist": False, "position": 1, "permissions": "0", "managed": False, "mentionable": False,
+            }
+            self.state.parse_guild_role_create({"guild_id": str(route.guild_id), "role": data})
+            return data
+        if path.endswith("/callback"):
+            return {"interaction": {"id": str(route.webhook_id), "type": 2, "response_message_id": self.new_id()}}
+        if path.startswith("/webhooks/") and method in ("POST", "PATCH"):
+            return self.message(0, payload)
+        if method == "GET":
+            return []
+        return None
+
+    def created(self, data: dict):
+        name = data["name"]
+        if self.recorded_channels[name]:
+            self.translate[self.recorded_channels[name].popleft()] = data["id"]
+        else:
+            self.created_channels[name].append(data["id"])
+
+    def recorded(self, data: dict):
+        """A recorded CHANNEL_CREATE: pair it with the channel we made for it."""
+        name = data.get("name")
+        if self.created_channels[name]:
+            self.translate[data["id"]] = self.created_channels[name].popleft()
+        else:
+            self.recorded_channels[name].append(data["id"])
+
+    def rewrite(self, obj):
+        if isinstance(obj, dict):
+            return {k: self.rewrite(v) for k, v in obj.items()}
+        if isinstance(obj, list):
+            return [self.rewrite(v) for v in obj]
+        if isinstance(obj, str):
+            return self.translate.get(obj, obj)
+        return obj
+
+
+# --- Driver ---
+def member_names(events) -> list:
+    names = []
+    for _, event, data in events:
+        if event == "GUILD_CREATE":
+            for m in data.get("members", []):
+                names.append(m.get("nick") or m["user"]["username"])
+    return names
+
+
+def install_stubs(app, stats: Stats, fake: FakeDiscord, pending: dict):
+    import discord
+
+    app.bot.http.request = fake.request
+    discord.webhook.async_.AsyncWebhookAdapter.request = (
+        lambda self, route, session=None, **kw: fake.webhook_request(route, session, **kw)
+    )
+    app.conn = Timed(app.conn, stats)
+    app.cursor = Timed(app.cursor, stats)
+
+    async def timed(name, coro):
+        t = time.perf_counter()
+        try:
+            return await coro
+        finally:
+            stats.latency[name].append(time.perf_counter() - t)
+
+    run_event = app.bot._run_event
+    app.bot._run_event = lambda coro, event_name, *a, **kw: timed(
+        f"event:{getattr(coro, '__name__', event_name)}", run_event(coro, event_name, *a, **kw)
+    )
+    tree_call = app.tree._call
+    app.tree._call = lambda interaction: timed(f"/{interaction.data.get('name')}", tree_call(interaction))
+
+    view_task = discord.ui.View._scheduled_task
+    discord.ui.View._scheduled_task = lambda self, item, interaction: timed(
+        f"view:{type(item).__name__}", view_task(self, item, interaction)
+    )
+    modal_task = discord.ui.Modal._scheduled_task
+    discord.ui.Modal._scheduled_task = lambda self, *a: timed(f"modal:{type(self).__name__}", modal_task(self, *a))
+
+    async def on_error(event, *args, **kwargs):
+        stats.errors[f"event:{event}"] += 1
+        if os.environ.get("REPLAY_VERBOSE"):
+            import traceback
+            traceback.print_exc()
+    app.bot.on_error = on_error
+
+    async def tree_error(interaction, error):
+        stats.errors[f"/{interaction.data.get('name')}"] += 1
+    app.tree.on_error = tree_error
+
+    async def view_error(self, interaction, error, item):
+        stats.errors[f"view:{type(item).__name__}"] += 1
+    discord.ui.View.on_error = view_error
+
+    async def modal_error(self, interaction, error):
+        stats.errors[f"modal:{type(self).__name__}"] += 1
+    discord.ui.Modal.on_error = modal_error
+
+    # remember the last ephemeral view / modal each user was shown, so the
+    # recorded follow-up interaction (whose custom_id was random) can be
+    # pointed at the one this run created
+    send_message = discord.InteractionResponse.send_message
+    send_modal = discord.InteractionResponse.send_modal
+
+    async def remember_view(self, *args, **kwargs):
+        response = await send_message(self, *args, **kwargs)
+        if kwargs.get("view") is not None:
+            pending[self._parent.user.id] = ("view", kwargs["view"], response.message_id)
+        return response
+
+    async def remember_modal(self, modal, /):
+        response = await send_modal(self, modal)
+        pending[self._parent.user.id] = ("modal", modal, None)
+        return response
+
+    discord.InteractionResponse.send_message = remember_view
+    discord.InteractionResponse.send_modal = remember_modal
+
+
+async def remap_interaction(app, data: dict, pending: dict, wait: float = 5.0):
+    """Point a recorded follow-up interaction at the view or modal this run
+    showed the user. At full speed the bot may not have shown it yet, so give
+    the handler that does a moment to catch up."""
+    store = app.bot._connection._view_store
+    inner = data.get("data", {})
+    if data["type"] == 5:
+        kind = "modal"
+        if inner.get("custom_id") in store._modals:
+            return
+    elif data["type"] == 3:
+        kind = "view"
+        if (inner.get("component_type"), inner.get("custom_id")) in store._views.get(None, {}):
+            return  # persistent panel button
+    else:
+        return
+
+    user = (data.get("member") or {}).get("user") or data.get("user") or {}
+    user_id = int(user.get("id", 0))
+    deadline = time.monotonic() + wait
+    while pending.get(user_id, (None,))[0] != kind and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    if pending.get(user_id, (None,))[0] != kind:
+        return
+    _, target, message_id = pending.pop(user_id)
+
+    if kind == "modal":
+        inner["custom_id"] = target.custom_id
+        # text inputs arrive wrapped in action rows or labels
+        inputs = [
+            c for row in inner.get("components", [])
+            for c in row.get("components") or [row.get("component", row)]
+        ]
+        for recorded, item in zip(inputs, target.children):
+            recorded["custom_id"] = item.custom_id
+    else:
+        item = next((i for i in target.children if i.type.value == inner.get("component_type")), None)
+        if item is None:
+            return
+        inner["custom_id"] = item.custom_id
+        if data.get("message") and message_id:
+            data["message"]["id"] = str(message_id)
+
+
+async def replay(args):
+    _, events = read_log(args.log)
+    stats = Stats()
+
+    os.environ.setdefault("DISCORD_BOT_TOKEN", "replay")
+    os.environ.setdefault("HYPIXEL_API_KEY", "replay")
+    os.environ.pop("RECORD_TRAFFIC", None)
+    upstream_url = start_fake_upstream(member_names(events), stats, args.upstream_latency)
+    os.environ["MOJANG_API_URL"] = os.environ["HYPIXEL_API_URL"] = upstream_url
+
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    db_path = os.path.join(workdir, "xp.db")
+    if args.db and os.path.exists(args.db):
+        shutil.copy(args.db, db_path)
+    os.environ["XP_DB_PATH"] = db_path
+
+    import discord
+    import bot as app
+
+    await app.bot._async_setup_hook()
+    await app.upstream.start()
+    app.register_panel_views(app.bot)
+    state = app.bot._connection
+    state._chunk_guilds = False
+    state.user = discord.ClientUser(state=state, data={
+        "id": "1", "username": "replay", "discriminator": "0", "avatar": None, "bot": True,
+    })
+    app.bot._ready.set()
+
+    fake = FakeDiscord(app, stats, args.rest_latency)
+    pending = {}
+    install_stubs(app, stats, fake, pending)
+
+    started = time.monotonic()
+    next_sync = args.sync_every if args.sync_every else None
+    background = set()
+
+    for offset, event, data in events:
+        if args.speed:
+            delay = offset / args.speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+        if next_sync is not None and offset >= next_sync:
+            next_sync += args.sync_every
+            task = asyncio.create_task(_timed_sync(app, stats))
+            background.add(task)
+
+        if event == "CHANNEL_CREATE":
+            # the bot's own channels are created by the fake REST layer
+            fake.recorded(data)
+            continue
+        if event in ("CHANNEL_UPDATE", "CHANNEL_DELETE"):
+            continue
+        data = fake.rewrite(data)
+        if event == "INTERACTION_CREATE":
+            await remap_interaction(app, data, pending)
+        try:
+            state.parsers[event](data)
+        except Exception as e:
+            stats.errors[f"parse:{event}"] += 1
+            if os.environ.get("REPLAY_VERBOSE"):
+                print(f"failed to parse {event}: {e!r}", file=sys.stderr)
+        # let handlers run between events even at full speed
+        await asyncio.sleep(0)
+
+    # drain whatever the replay kicked off
+    current = asyncio.current_task()
+    in_flight = [
+        t for t in asyncio.all_tasks()
+        # views and modals keep a timeout task alive; those aren't handlers
+        if t is not current and not t.done() and not t.get_coro().__qualname__.endswith("__timeout_task_impl")
+    ]
+    if in_flight:
+        await asyncio.wait(in_flight, timeout=args.drain)
+    wall = time.monotonic() - started
+
+    print(stats.report(len(events), wall))
+    await app.upstream.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+async def _timed_sync(app, stats: Stats):
+    t = time.perf_counter()
+    try:
+        await app.daily_guild_check()
+    except Exception:
+        stats.errors["task:daily_guild_check"] += 1
+    stats.latency["task:daily_guild_check"].append(time.perf_counter() - t)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("log", help="log written with RECORD_TRAFFIC")
+    parser.add_argument("--speed", type=float, default=0,
+                        help="1 = real time, 2 = twice as fast, 0 = as fast as possible (default)")
+    parser.add_argument("--rest-latency", type=float, default=0.0, help="seconds added to each Discord REST call")
+    parser.add_argument("--upstream-latency", type=float, default=0.0, help="seconds added to each Mojang/Hypixel call")
+    parser.add_argument("--sync-every", type=float, default=0,
+                        help="run daily_guild_check every N seconds of log time (0 = never)")
+    parser.add_argument("--db", default="xp.db", help="database to copy as the starting state")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for in-flight handlers at the end")
+    asyncio.run(replay(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import re
+import time
+
+# gateway dispatches worth replaying; everything else is dropped
+RECORD_EVENTS = {
+    "GUILD_CREATE",
+    "GUILD_MEMBER_ADD",
+    "GUILD_MEMBER_UPDATE",
+    "GUILD_MEMBER_REMOVE",
+    "CHANNEL_CREATE",
+    "CHANNEL_UPDATE",
+    "CHANNEL_DELETE",
+    "MESSAGE_CREATE",
+    "MESSAGE_REACTION_ADD",
+    "MESSAGE_REACTION_REMOVE",
+    "INTERACTION_CREATE",
+}
+
+# bulky guild state the replayer doesn't need
+DROP_GUILD_KEYS = ("presences", "voice_states", "threads", "stage_instances",
+                   "emojis", "stickers", "guild_scheduled_events", "soundboard_sounds")
+
+SNOWFLAKE = re.compile(r"^\d{15,21}$")
+# numeric strings that are bitfields, not IDs
+NOT_IDS = {"permissions", "allow", "deny", "app_permissions", "flags", "nonce"}
+NAMES = {"username", "global_name", "nick"}
+# blanked rather than dropped, since discord.py expects the keys to exist
+SCRUB = {"avatar", "banner", "avatar_decoration_data", "email", "attachments", "embeds"}
+# user-entered values live under these keys (modal inputs, slash-command options)
+INPUTS = {"components", "options"}
+# channels the bot names after their owner, e.g. "application-<username>"
+USER_CHANNEL = re.compile(r"^(application|giveaway)-(.+)$")
+
+
+class Anonymizer:
+    """Maps snowflakes and user-facing text to stable pseudonyms.
+
+    The mapping is keyed by a random per-recording salt, so IDs stay consistent
+    within one log (a user's messages and interactions still line up) but
+    can't be reversed or joined across logs."""
+
+    def __init__(self, keep_ids=(), salt: bytes = None):
+        self.salt = salt or os.urandom(16)
+        self.keep = {str(i) for i in keep_ids}
+
+    def _digest(self, value: str) -> bytes:
+        return hmac.new(self.salt, value.encode(), hashlib.sha256).digest()
+
+    def snowflake(self, value: str) -> str:
+        if value in self.keep:
+            return value
+        # keep it snowflake-shaped (positive, 18-19 digits)
+        return str(int.from_bytes(self._digest(value)[:8], "big") >> 2 | 1 << 59)
+
+    def name(self, value: str) -> str:
+        return "user" + self._digest(value).hex()[:8]
+
+    def __call__(self, obj, key: str = None, in_inputs: bool = False):
+        if key in SCRUB:
+            return [] if isinstance(obj, list) else None
+        if isinstance(obj, dict):
+            inputs = in_inputs or key in INPUTS
+            # interaction "resolved" maps are keyed by snowflake
+            return {
+                self.snowflake(k) if SNOWFLAKE.match(k) else k: self(v, k, inputs)
+                for k, v in obj.items()
+            }
+        if isinstance(obj, list):
+            return [self(v, key, in_inputs) for v in obj]
+        if not isinstance(obj, str):
+            return obj
+        if key == "token":
+            return "redacted"
+        if key == "content":
+            return "x" * len(obj)
+        if key in NAMES:
+            return self.name(obj)
+        if key == "value" and in_inputs:
+            # modal text or a command option, e.g. a Minecraft name or a prize;
+            # user/channel options still map like every other snowflake
+            return self.snowflake(obj) if SNOWFLAKE.match(obj) else self.name(obj)
+        if key == "name":
+            owned = USER_CHANNEL.match(obj)
+            if owned:
+                # same pseudonym as the owner's username, so replay can pair it
+                return f"{owned.group(1)}-{self.name(owned.group(2))}"
+        if key not in NOT_IDS and SNOWFLAKE.match(obj):
+            return self.snowflake(obj)
+        return obj
+
+
+class TrafficRecorder:
+    """Writes gateway dispatches to a gzipped JSON-lines log.
+
+    The first line is a header; every following line is
+    [seconds_since_start, event_type, anonymized_payload]."""
+
+    def __init__(self, path: str, keep_ids=(), guild_id: int = None):
+        self.path = path
+        self.guild_id = str(guild_id) if guild_id else None
+        self.anonymize = Anonymizer(keep_ids=keep_ids)
+        self.started = time.monotonic()
+        self.count = 0
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._write({"version": 1, "started": time.time(), "guild_id": self.guild_id})
+
+    def _write(self, obj):
+        self._file.write(json.dumps(obj, separators=(",", ":")) + "\n")
+
+    def record(self, msg):
+        """Feed a raw gateway message (dict or JSON string)."""
+        if self._file is None:
+            return
+        if isinstance(msg, (str, bytes)):
+            msg = json.loads(msg)
+        if msg.get("op") != 0 or msg.get("t") not in RECORD_EVENTS:
+            return
+        event, data = msg["t"], msg["d"]
+        if event == "GUILD_CREATE":
+            if self.guild_id and data.get("id") != self.guild_id:
+                return
+            data = {k: v for k, v in data.items() if k not in DROP_GUILD_KEYS}
+        elif self.guild_id and data.get("guild_id") not in (None, self.guild_id):
+            return
+        offset = round(time.monotonic() - self.started, 3)
+        self._write([offset, event, self.anonymize(data)])
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_log(path: str):
+    """Return (header, events) from a recorded log."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = json.loads(f.readline())
+        events = [json.loads(line) for line in f if line.strip()]
+    return header, events
@@ -0,0 +1,212 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+
+MOJANG_URL = "https://api.mojang.com"
+HYPIXEL_URL = "https://api.hypixel.net"
+
+
+class UpstreamError(Exception):
+    """An upstream API call failed after retries."""
+
+
+class CircuitOpenError(UpstreamError):
+    """The upstream is marked as down; the call was not attempted."""
+
+
+class RateLimitedError(UpstreamError):
+    """The rate limit would make the caller wait longer than allowed."""
+
+
+class RateLimiter:
+    """Tracks Hypixel's RateLimit-Remaining/RateLimit-Reset headers."""
+
+    def __init__(self, max_wait: float = 10.0):
+        self.max_wait = max_wait
+        self.remaining = None
+        self.reset_at = 0.0
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            now = time.monotonic()
+            if now >= self.reset_at:
+                self.remaining = None
+            if self.remaining is not None and self.remaining <= 0:
+                wait = self.reset_at - now
+                if wait > self.max_wait:
+                    raise RateLimitedError(f"rate limited for another {wait:.0f}s")
+                await asyncio.sleep(wait)
+                self.remaining = None
+            if self.remaining is not None:
+                self.remaining -= 1
+
+    def update(self, headers):
+        remaining = headers.get("RateLimit-Remaining")
+        reset = headers.get("RateLimit-Reset")
+        try:
+            if remaining is not None:
+                self.remaining = int(remaining)
+            if reset is not None:
+                self.reset_at = time.monotonic() + float(reset)
+        except ValueError:
+            pass
+
+    def block_for(self, seconds: float):
+        self.remaining = 0
+        self.reset_at = max(self.reset_at, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """Opens after `threshold` consecutive failures and lets a single probe
+    through once `cooldown` seconds have passed."""
+
+    def __init__(self, threshold: int = 5, cooldown: float = 60.0):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def before_call(self):
+        if self.opened_at is None:
+            return
+        now = time.monotonic()
+        if now - self.opened_at < self.cooldown:
+            raise CircuitOpenError("upstream is unavailable, try again later")
+        # half-open: re-arm so only this call probes until it reports back
+        self.opened_at = now
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.threshold:
+            self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    """One long-lived, pooled session for every Mojang and Hypixel call.
+
+    Start it from the bot's setup hook and close it on shutdown. The base URLs
+    can be pointed at a local fake server for testing."""
+
+    def __init__(
+        self,
+        hypixel_key: str,
+        *,
+        mojang_url: str = MOJANG_URL,
+        hypixel_url: str = HYPIXEL_URL,
+        limit_per_host: int = 8,
+        timeout: float = 10.0,
+        retries: int = 3,
+        backoff: float = 0.5,
+        max_backoff: float = 8.0,
+        breaker_threshold: int = 5,
+        breaker_cooldown: float = 60.0,
+        max_rate_wait: float = 10.0,
+    ):
+        self.hypixel_key = hypixel_key
+        self.mojang_url = mojang_url.rstrip("/")
+        self.hypixel_url = hypixel_url.rstrip("/")
+        self.limit_per_host = limit_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.rate_limiter = RateLimiter(max_wait=max_rate_wait)
+        self.breakers = {
+            "mojang": CircuitBreaker(breaker_threshold, breaker_cooldown),
+            "hypixel": CircuitBreaker(breaker_threshold, breaker_cooldown),
+        }
+        self.session = None
+
+    async def start(self):
+        if self.session is not None:
+            return
+        connector = aiohttp.TCPConnector(
+            limit=self.limit_per_host * 4,
+            limit_per_host=self.limit_per_host,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        self.session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+            raise_for_status=False,
+        )
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def get_uuid(self, mc_name: str):
+        """Return the Mojang UUID for a username, or None if it doesn't exist
+        or Mojang rejects it as invalid."""
+        status, data = await self._get(
+            "mojang", f"{self.mojang_url}/users/profiles/minecraft/{mc_name}",
+            ok_statuses=(200, 204),
+        )
+        if status != 200 or not data:
+            return None
+        return data["id"]
+
+    async def get_guild(self, name: str) -> dict:
+        """Return the Hypixel guild object for a guild name."""
+        status, data = await self._get(
+            "hypixel", f"{self.hypixel_url}/guild",
+            params={"key": self.hypixel_key, "name": name},
+        )
+        if status != 200:
+            raise UpstreamError(f"hypixel returned HTTP {status}")
+        if not data or not data.get("success") or not data.get("guild"):
+            raise UpstreamError(f"Hypixel returned no guild for {name!r}")
+        return data["guild"]
+
+    def _delay(self, attempt: int) -> float:
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    async def _get(self, service: str, url: str, params=None, ok_statuses=(200,)):
+        if self.session is None:
+            raise UpstreamError("upstream client is not started")
+        breaker = self.breakers[service]
+
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self._delay(attempt - 1))
+            if service == "hypixel":
+                await self.rate_limiter.acquire()
+            if not attempt:
+                # after acquire(): a half-open breaker re-arms here, so a call that
+                # is rate limited before sending anything mustn't use up the probe
+                breaker.before_call()
+            try:
+                async with self.session.get(url, params=params) as resp:
+                    if service == "hypixel":
+                        self.rate_limiter.update(resp.headers)
+                    # other client errors (e.g. Mojang's 400 for a malformed name) won't
+                    # get better by retrying, and they mean the service is up: hand the
+                    # status back as a "not found" instead of tripping the breaker
+                    if resp.status in ok_statuses or (400 <= resp.status < 500 and resp.status != 429):
+                        data = await resp.json(content_type=None) if resp.status == 200 else None
+                        breaker.record_success()
+                        return resp.status, data
+                    last_error = UpstreamError(f"{service} returned HTTP {resp.status}")
+                    if resp.status == 429 and service == "hypixel":
+                        retry_after = resp.headers.get("Retry-After")
+                        if retry_after and retry_after.isdigit():
+                            self.rate_limiter.block_for(int(retry_after))
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                last_error = UpstreamError(f"{service} request failed: {e!r}")
+
+        breaker.record_failure()
+        raise last_error